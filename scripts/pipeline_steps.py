@@ -5,9 +5,14 @@ Individual step implementations for the workflow
 
 import os
 import sys
-import subprocess
+import asyncio
+import shutil
+import tempfile
+import threading
+import functools
+import multiprocessing
 import logging
-import csv
+import logging.handlers
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from typing import List, Optional
@@ -16,13 +21,45 @@ import numpy as np
 import nibabel as nib
 from nibabel import processing
 
+# lxml is preferred for streaming annotation parsing; fall back to the standard library
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# numba is optional; block painting falls back to NumPy slice assignment without it
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# pyarrow enables pandas' multithreaded CSV reader; fall back to the C engine
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
 # Import utilities
-from pipeline_utils import PipelineConfig, create_output_directories, check_existing_outputs, run_r_script
+from pipeline_utils import (
+    PipelineConfig, create_output_directories, check_existing_outputs, find_complete_subjects, run_r_script_async,
+    cache_key, content_cache_key, restore_cached_outputs, store_cached_outputs,
+    prefetch_file, run_command_async, init_worker_logging
+)
 
 
 class BaseStep:
     """Base class for pipeline steps"""
     
+    # Whether subjects can be processed concurrently in worker processes
+    parallel_safe = True
+    
+    # Configuration keys that affect this step's outputs (part of the output cache key)
+    cache_config_keys: List[str] = []
+    
+    # Bump when a change to the step alters its outputs, so older cache entries are not reused
+    cache_version = '1'
+    
     def __init__(self, config: PipelineConfig):
         """Initialize step with configuration
         
@@ -30,6 +67,8 @@ class BaseStep:
             config: Pipeline configuration
         """
         self.config = config
+        # Set from execute(); --force also bypasses the output cache
+        self._force = False
     
     def execute(self, subjects: List[int], force: bool = False, dry_run: bool = False, logger: Optional[logging.Logger] = None) -> bool:
         """Execute the step for all subjects
@@ -46,11 +85,10 @@ class BaseStep:
         if logger is None:
             logger = logging.getLogger(__name__)
         
+        self._force = force
+        
         # Check existing outputs
-        if not force:
-            existing = check_existing_outputs(self.config, subjects, self.get_step_suffix(), logger)
-            if existing:
-                subjects = [s for s in subjects if s not in existing]
+        subjects = self._remaining_subjects(subjects, force, logger)
         
         if not subjects:
             logger.info("No subjects to process")
@@ -60,13 +98,108 @@ class BaseStep:
         create_output_directories(self.config, subjects, logger)
         
         # Process subjects
+        success_count = self._process_subjects(subjects, dry_run, logger)
+        
+        logger.info(f"Step completed: {success_count}/{len(subjects)} subjects successful")
+        return success_count == len(subjects)
+    
+    def _process_subjects(self, subjects: List[int], dry_run: bool, logger: logging.Logger) -> int:
+        """Process subjects serially, or in a worker pool when parallel processing is enabled
+        
+        Args:
+            subjects: List of subject IDs
+            dry_run: Show what would be done without executing
+            logger: Logger instance
+        
+        Returns:
+            Number of subjects processed successfully
+        """
+        max_workers = self.config.get_max_workers(len(subjects)) if self.parallel_safe and not dry_run else 1
+        if max_workers > 1:
+            logger.info(f"Processing {len(subjects)} subjects with {max_workers} workers")
+            worker = functools.partial(self._process_subject, dry_run=dry_run, logger=logger)
+            # Workers log through a queue so their records reach this process's
+            # handlers whatever the start method (fork, spawn or forkserver)
+            root = logging.getLogger()
+            log_queue = multiprocessing.Queue()
+            listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+            listener.start()
+            try:
+                with multiprocessing.Pool(max_workers, initializer=init_worker_logging,
+                                          initargs=(log_queue, root.level)) as pool:
+                    success_count = sum(pool.imap_unordered(worker, subjects))
+                    # Let workers exit normally so their queued records are flushed
+                    pool.close()
+                    pool.join()
+                return success_count
+            finally:
+                listener.stop()
+        
         success_count = 0
-        for subject in subjects:
+        for i, subject in enumerate(subjects):
+            # Let the next subject's inputs load while this one is processed
+            if not dry_run and i + 1 < len(subjects):
+                self._prefetch_inputs(subjects[i + 1])
             if self._process_subject(subject, dry_run, logger):
                 success_count += 1
+        return success_count
+    
+    def _expected_outputs(self, subject_id: int) -> List[Path]:
+        """Get the files a completed run of this step leaves for a subject
         
-        logger.info(f"Step completed: {success_count}/{len(subjects)} subjects successful")
-        return success_count == len(subjects)
+        Args:
+            subject_id: Subject ID
+        
+        Returns:
+            Expected output files, or an empty list if they are not known up front
+        """
+        return []
+    
+    def _remaining_subjects(self, subjects: List[int], force: bool, logger: logging.Logger) -> List[int]:
+        """Filter out subjects whose outputs already exist
+        
+        Steps that declare _expected_outputs are checked file by file, so a partial
+        run is redone; other steps fall back to a non-empty output directory check.
+        
+        Args:
+            subjects: List of subject IDs
+            force: Keep every subject
+            logger: Logger instance
+        
+        Returns:
+            Subjects that still need processing
+        """
+        if force:
+            return subjects
+        expected = {subject: self._expected_outputs(subject) for subject in subjects}
+        if any(expected.values()):
+            existing = find_complete_subjects(expected)
+            if existing:
+                logger.warning(f"Found existing output for {len(existing)} subjects in step {self.get_step_suffix()}")
+        else:
+            existing = check_existing_outputs(self.config, subjects, self.get_step_suffix(), logger)
+        return [s for s in subjects if s not in existing]
+    
+    def _prefetch_inputs(self, subject_id: int):
+        """Start reading a subject's large input files ahead of processing
+        
+        Args:
+            subject_id: Subject ID
+        """
+        pass
+    
+    def _output_cache_key(self, inputs: List[Path]) -> str:
+        """Compute the output cache key for a subject's input files
+        
+        Args:
+            inputs: Input files read by the step
+        
+        Returns:
+            Cache key combining the inputs, this step's cache_config_keys and cache_version
+        """
+        config_subset = {key: self.config.get(key) for key in self.cache_config_keys}
+        config_subset['cache_version'] = self.cache_version
+        return cache_key(inputs, config_subset)
     
     def get_step_suffix(self) -> str:
         """Get the step directory suffix
@@ -93,15 +226,20 @@ class BaseStep:
 class UpsamplingStep(BaseStep):
     """Step 1: Manual upsampling and reorientation (requires FSLeyes GUI)"""
     
+    parallel_safe = False
+    
     def get_step_suffix(self) -> str:
         return "_upsampled"
     
+    def _expected_outputs(self, subject_id: int) -> List[Path]:
+        output_dir = self.config.get_subject_step_dir(subject_id, self.get_step_suffix())
+        return [output_dir / f"{subject_id}_001_up_re.nii.gz"]
+    
     def _process_subject(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
         """Check for manually created upsampled files"""
         try:
             # Check for the expected upsampled file
-            output_dir = self.config.get_subject_step_dir(subject_id, self.get_step_suffix())
-            expected_file = output_dir / f"{subject_id}_001_up_re.nii.gz"
+            expected_file, = self._expected_outputs(subject_id)
             
             if dry_run:
                 logger.info(f"DRY RUN: Would check for {expected_file}")
@@ -128,7 +266,33 @@ class SlicingStep(BaseStep):
     def get_step_suffix(self) -> str:
         return "_slices"
     
+    def _process_subjects(self, subjects: List[int], dry_run: bool, logger: logging.Logger) -> int:
+        """Slice subjects concurrently, overlapping their Rscript processes
+        
+        The work happens inside Rscript, so an event loop awaiting up to
+        r_concurrency subprocesses replaces the worker pool for this step. Each
+        script loads a whole upsampled volume, so without parallel_processing
+        subjects are sliced one at a time.
+        """
+        return asyncio.run(self._process_subjects_async(subjects, dry_run, logger))
+    
+    async def _process_subjects_async(self, subjects: List[int], dry_run: bool, logger: logging.Logger) -> int:
+        """Process subjects with at most r_concurrency R scripts running at once"""
+        concurrency = int(self.config.get('r_concurrency', 4)) if self.config.get('parallel_processing', False) else 1
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def process_one(subject_id: int) -> bool:
+            async with semaphore:
+                return await self._process_subject_async(subject_id, dry_run, logger)
+        
+        results = await asyncio.gather(*(process_one(subject_id) for subject_id in subjects))
+        return sum(results)
+    
     def _process_subject(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
+        """Generate brain slices for a subject using R script"""
+        return asyncio.run(self._process_subject_async(subject_id, dry_run, logger))
+    
+    async def _process_subject_async(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
         """Generate brain slices for a subject using R script"""
         try:
             # Get input and output paths
@@ -151,84 +315,97 @@ class SlicingStep(BaseStep):
             # Create output directory
             output_dir.mkdir(parents=True, exist_ok=True)
             
-            # Copy the NIfTI file to the expected location for R script
-            # The R script expects the file to be in {subject_id}X/{subject_id}_001_up_re.nii.gz
-            r_input_dir = Path(f"{subject_id}X")
-            r_input_dir.mkdir(exist_ok=True)
-            r_input_file = r_input_dir / f"{subject_id}_001_up_re.nii.gz"
-            
-            # Copy file if it doesn't exist or is different
-            if not r_input_file.exists() or not r_input_file.samefile(input_nii):
-                import shutil
-                shutil.copy2(input_nii, r_input_file)
-            
-            # Run R script
-            r_script_path = "scripts/virtualmeatslicerNative.R"
-            
-            # Run R script
-            success = run_r_script(
-                r_script_path,
-                [str(subject_id)],
-                logger,
-                cwd=Path.cwd()
-            )
+            # Fallback copies of large files run in a thread so other subjects keep going
+            loop = asyncio.get_running_loop()
             
-            if success:
-                # Move generated slices to output directory
-                slices_dir = Path(f"{subject_id}_slices")
-                if slices_dir.exists():
-                    import shutil
-                    for slice_file in slices_dir.glob("*.png"):
-                        shutil.move(str(slice_file), str(output_dir / slice_file.name))
-                    
-                    # Remove temporary slices directory
-                    slices_dir.rmdir()
+            # Resolve the R script before switching its working directory
+            r_script_path = str(Path("scripts/virtualmeatslicerNative.R").resolve())
+            
+            # Run the R script in a private working directory so subjects don't collide;
+            # the directory and its contents are removed on exit. It sits next to the
+            # output directory so the links and renames below stay on one filesystem
+            with tempfile.TemporaryDirectory(prefix=f".{subject_id}_slicing_", dir=output_dir.parent) as work_dir:
+                work_dir = Path(work_dir)
                 
-                # Clean up temporary input directory and file
-                try:
-                    import shutil
-                    if r_input_dir.exists():
-                        shutil.rmtree(r_input_dir)
-                        logger.debug(f"Subject {subject_id}: Cleaned up temporary directory {r_input_dir}")
-                except Exception as e:
-                    logger.warning(f"Subject {subject_id}: Failed to clean up temporary directory {r_input_dir}: {e}")
+                # The R script expects the file to be in {subject_id}X/{subject_id}_001_up_re.nii.gz
+                r_input_dir = work_dir / f"{subject_id}X"
+                r_input_dir.mkdir()
+                r_input_file = r_input_dir / f"{subject_id}_001_up_re.nii.gz"
                 
-                logger.info(f"Subject {subject_id}: Generated slices in {output_dir}")
-                return True
-            else:
-                # Clean up temporary input directory even if R script failed
+                # Hardlink the input where possible, falling back to a copy across filesystems
                 try:
-                    import shutil
-                    if r_input_dir.exists():
-                        shutil.rmtree(r_input_dir)
-                        logger.debug(f"Subject {subject_id}: Cleaned up temporary directory {r_input_dir} after failure")
-                except Exception as e:
-                    logger.warning(f"Subject {subject_id}: Failed to clean up temporary directory {r_input_dir}: {e}")
+                    os.link(input_nii, r_input_file)
+                except OSError:
+                    await loop.run_in_executor(None, shutil.copy2, input_nii, r_input_file)
                 
-                logger.error(f"Subject {subject_id}: R script failed")
-                return False
+                # Run R script
+                success = await run_r_script_async(
+                    r_script_path,
+                    [str(subject_id)],
+                    logger,
+                    cwd=work_dir
+                )
+                
+                if not success:
+                    logger.error(f"Subject {subject_id}: R script failed")
+                    return False
+                
+                # Move generated slices to output directory (rename, copying only across filesystems)
+                slices_dir = work_dir / f"{subject_id}_slices"
+                if slices_dir.exists():
+                    for slice_file in slices_dir.glob("*.png"):
+                        try:
+                            os.replace(slice_file, output_dir / slice_file.name)
+                        except OSError:
+                            await loop.run_in_executor(None, shutil.move, str(slice_file),
+                                                       str(output_dir / slice_file.name))
             
-        except Exception as e:
-            # Clean up temporary input directory in case of exception
-            try:
-                import shutil
-                r_input_dir = Path(f"{subject_id}X")
-                if r_input_dir.exists():
-                    shutil.rmtree(r_input_dir)
-                    logger.debug(f"Subject {subject_id}: Cleaned up temporary directory {r_input_dir} after exception")
-            except Exception as cleanup_error:
-                logger.warning(f"Subject {subject_id}: Failed to clean up temporary directory {r_input_dir}: {cleanup_error}")
+            logger.info(f"Subject {subject_id}: Generated slices in {output_dir}")
+            return True
             
+        except Exception as e:
             logger.error(f"Subject {subject_id}: Slicing failed - {e}")
             return False
 
 
+# Buffer size for CSV writes; large buffers turn many small writes into a few big ones
+CSV_WRITE_BUFFER_SIZE = 1 << 20
+
+
+def _write_csv(df: pd.DataFrame, output_file: Path):
+    """Write a DataFrame to CSV (without the index) through a large write buffer"""
+    with open(output_file, 'w', newline='', buffering=CSV_WRITE_BUFFER_SIZE) as f:
+        df.to_csv(f, index=False)
+
+
+@functools.lru_cache(maxsize=2)
+def _read_summary_csv(csv_path: str, mtime_ns: int) -> pd.DataFrame:
+    """Read the columns of the Halo Summary Analysis CSV used for AT8 extraction
+    
+    Cached per (path, mtime); callers must not modify the returned DataFrame.
+    """
+    return pd.read_csv(
+        csv_path,
+        encoding='latin-1',
+        engine=CSV_ENGINE,
+        usecols=['Image Tag', 'Analysis Region', '% AT8 Positive Tissue']
+    )
+
+
 class CoordinateExtractionStep(BaseStep):
     """Step 3: Extract coordinates and AT8 values from Halo annotations"""
     
     def get_step_suffix(self) -> str:
         return "_coordinates"
     
+    def _expected_outputs(self, subject_id: int) -> List[Path]:
+        output_dir = self.config.get_subject_step_dir(subject_id, self.get_step_suffix())
+        return [
+            output_dir / f"{subject_id}_tile_coord.csv",
+            output_dir / f"{subject_id}_AT8.csv",
+            output_dir / f"{subject_id}_tile_proc.csv"
+        ]
+    
     def _process_subject(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
         """Extract coordinates and AT8 values for a subject"""
         try:
@@ -250,29 +427,36 @@ class CoordinateExtractionStep(BaseStep):
                 logger.error(f"Subject {subject_id}: Summary CSV file not found - {summary_csv_file}")
                 return False
             
+            output_files = self._expected_outputs(subject_id)
+            coord_output_file, at8_output_file, proc_output_file = output_files
+            
+            # Reuse outputs from a previous run with identical inputs
+            key = self._output_cache_key([annotation_file, summary_csv_file])
+            if restore_cached_outputs(self.config, self.get_step_suffix(), key, output_files, logger, force=self._force):
+                logger.info(f"Subject {subject_id}: Restored coordinate extraction outputs from cache")
+                return True
+            
             logger.info(f"Subject {subject_id}: Processing {annotation_file}")
             
             # Parse XML and extract coordinates
-            coordinates = self._extract_coordinates_from_xml(annotation_file, logger)
+            coords_df = self._extract_coordinates_from_xml(annotation_file, logger)
             
-            if not coordinates:
+            if coords_df.empty:
                 logger.error(f"Subject {subject_id}: No coordinates extracted")
                 return False
             
             # Extract AT8 values from CSV
-            at8_values = self._extract_at8_values_from_csv(summary_csv_file, subject_id, logger)
+            at8_df = self._extract_at8_values_from_csv(summary_csv_file, subject_id, logger)
             
-            # Save coordinates to CSV
-            coord_output_file = output_dir / f"{subject_id}_tile_coord.csv"
-            self._save_coordinates_to_csv(coordinates, coord_output_file)
+            # Create processed table (combining coordinates and AT8)
+            proc_df = self._create_processed_file(coords_df, at8_df)
             
-            # Save AT8 values to CSV
-            at8_output_file = output_dir / f"{subject_id}_AT8.csv"
-            self._create_at8_file(at8_values, at8_output_file)
+            # Save coordinates, AT8 values and processed table, each written once
+            _write_csv(coords_df, coord_output_file)
+            _write_csv(at8_df, at8_output_file)
+            _write_csv(proc_df, proc_output_file)
             
-            # Create processed file (combining coordinates and AT8)
-            proc_output_file = output_dir / f"{subject_id}_tile_proc.csv"
-            self._create_processed_file(coord_output_file, at8_output_file, proc_output_file)
+            store_cached_outputs(self.config, self.get_step_suffix(), key, output_files, logger)
             
             logger.info(f"Subject {subject_id}: Coordinate extraction completed")
             return True
@@ -281,137 +465,178 @@ class CoordinateExtractionStep(BaseStep):
             logger.error(f"Subject {subject_id}: Coordinate extraction failed - {e}")
             return False
     
-    def _extract_coordinates_from_xml(self, annotation_file: Path, logger: logging.Logger) -> List[dict]:
-        """Extract coordinates from XML annotation file"""
+    def _extract_coordinates_from_xml(self, annotation_file: Path, logger: logging.Logger) -> pd.DataFrame:
+        """Extract coordinates from XML annotation file as a Name/X/Y DataFrame"""
         try:
-            tree = ET.parse(annotation_file)
-            root = tree.getroot()
+            # Stream annotations instead of building the whole tree
+            if etree is not None:
+                context = etree.iterparse(str(annotation_file), events=('end',), tag='Annotation')
+            else:
+                context = ET.iterparse(str(annotation_file), events=('end',))
             
-            coordinates = []
+            names, xs, ys = [], [], []
             
-            for annotation in root.findall(".//Annotation"):
+            for _, annotation in context:
+                if annotation.tag != 'Annotation':
+                    continue
+                
                 name = annotation.get("Name")
                 
                 # Skip Layer 1 annotations
-                if name == "Layer 1":
-                    continue
+                if name != "Layer 1":
+                    # Extract coordinates
+                    for vertex in annotation.iter("V"):
+                        names.append(name)
+                        xs.append(vertex.get("X"))
+                        ys.append(vertex.get("Y"))
                 
-                # Extract coordinates
-                for vertex in annotation.findall(".//V"):
-                    x = vertex.get("X")
-                    y = vertex.get("Y")
-                    
-                    coordinates.append({
-                        'Name': name,
-                        'X': x,
-                        'Y': y
-                    })
-            
-            logger.info(f"Extracted {len(coordinates)} coordinates (excluding Layer 1)")
-            return coordinates
+                # Release the parsed annotation and any preceding siblings
+                annotation.clear()
+                if etree is not None:
+                    while annotation.getprevious() is not None:
+                        del annotation.getparent()[0]
+            
+            logger.info(f"Extracted {len(names)} coordinates (excluding Layer 1)")
+            return pd.DataFrame({'Name': names, 'X': pd.to_numeric(xs), 'Y': pd.to_numeric(ys)})
             
         except Exception as e:
             logger.error(f"Failed to parse XML file {annotation_file}: {e}")
-            return []
+            return pd.DataFrame({'Name': [], 'X': [], 'Y': []})
     
-    def _extract_at8_values_from_csv(self, csv_file: Path, subject_id: int, logger: logging.Logger) -> List[dict]:
-        """Extract AT8 values from Summary Analysis CSV file"""
+    def _extract_at8_values_from_csv(self, csv_file: Path, subject_id: int, logger: logging.Logger) -> pd.DataFrame:
+        """Extract AT8 values from Summary Analysis CSV file as a Tile/AT8_Value DataFrame"""
         try:
-            # Read the CSV file with proper encoding
-            df = pd.read_csv(csv_file, encoding='latin-1')
+            # Read the CSV file with proper encoding (parsed once and shared by all subjects)
+            df = _read_summary_csv(str(csv_file), csv_file.stat().st_mtime_ns)
             
-            # Filter for the specific subject
+            # Filter for the specific subject, keeping only tile data (skip Layer 1)
             subject_pattern = f"{subject_id}-"
-            subject_data = df[df['Image Tag'].str.contains(subject_pattern, na=False)]
-            
-            at8_values = []
+            mask = (df['Image Tag'].str.contains(subject_pattern, na=False, regex=False) &
+                    df['Analysis Region'].str.startswith('Tile', na=False))
+            subject_data = df.loc[mask, ['Analysis Region', '% AT8 Positive Tissue']]
             
-            for _, row in subject_data.iterrows():
-                analysis_region = row['Analysis Region']
-                at8_percentage = row['% AT8 Positive Tissue']
-                
-                # Only include tile data (skip Layer 1)
-                if analysis_region.startswith('Tile'):
-                    at8_values.append({
-                        'Tile': analysis_region,
-                        'AT8_Value': float(at8_percentage)
-                    })
+            at8_df = pd.DataFrame({
+                'Tile': subject_data['Analysis Region'].to_numpy(),
+                'AT8_Value': subject_data['% AT8 Positive Tissue'].to_numpy(dtype=np.float64)
+            })
             
-            logger.info(f"Extracted {len(at8_values)} AT8 values for subject {subject_id}")
-            return at8_values
+            logger.info(f"Extracted {len(at8_df)} AT8 values for subject {subject_id}")
+            return at8_df
             
         except Exception as e:
             logger.error(f"Failed to extract AT8 values from CSV file {csv_file}: {e}")
-            return []
-    
-    def _save_coordinates_to_csv(self, coordinates: List[dict], output_file: Path):
-        """Save coordinates to CSV file"""
-        with open(output_file, 'w', newline='') as csvfile:
-            if coordinates:
-                fieldnames = coordinates[0].keys()
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(coordinates)
-    
-    def _create_at8_file(self, at8_values: List[dict], output_file: Path):
-        """Create AT8 file from extracted values"""
-        with open(output_file, 'w', newline='') as csvfile:
-            if at8_values:
-                fieldnames = at8_values[0].keys()
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(at8_values)
-            else:
-                # If no AT8 values found, create empty file with headers
-                writer = csv.DictWriter(csvfile, fieldnames=['Tile', 'AT8_Value'])
-                writer.writeheader()
+            return pd.DataFrame({'Tile': [], 'AT8_Value': []})
     
-    def _create_processed_file(self, coord_file: Path, at8_file: Path, output_file: Path):
-        """Create processed file combining coordinates and AT8 values"""
+    def _create_processed_file(self, df_tiles: pd.DataFrame, df_at8: pd.DataFrame) -> pd.DataFrame:
+        """Create processed table combining coordinates and AT8 values"""
         try:
-            # Read coordinates
-            df_tiles = pd.read_csv(coord_file)
-            
-            # Read AT8 values
-            df_at8 = pd.read_csv(at8_file)
-            
             if len(df_at8) == 0:
-                # If no AT8 values, create a simple processed file with just coordinates
-                df_tiles['AT8'] = 0  # Default value
-                df_tiles.to_csv(output_file, index=False)
-                return
+                # If no AT8 values, create a simple processed table with just coordinates
+                return df_tiles.assign(AT8=0)  # Default value
             
             # Process according to the reference script logic
             n_i, n_j = df_at8.shape
-            tile_coords = np.empty([n_i, 4], dtype=object)
             
-            for i in range(n_i):
-                y = 5 * i  # Sample every 5th coordinate
-                if y < len(df_tiles):
-                    tile_coords[i][0] = df_tiles.iloc[y, 0]  # Name
-                    tile_coords[i][1] = int(df_tiles.iloc[y, 1]) // 1000  # X coordinate
-                    tile_coords[i][2] = int(df_tiles.iloc[y, 2]) // 1000  # Y coordinate (as Z)
-                    tile_coords[i][3] = df_at8.iloc[i, 1]  # AT8 value
+            # Sample every 5th coordinate, dropping indices past the end
+            idx = np.arange(n_i) * 5
+            idx = idx[idx < len(df_tiles)]
             
             # Create DataFrame
-            df = pd.DataFrame(tile_coords)
-            df = df.rename(columns={0: "Tile", 1: "X", 2: "Z", 3: "AT8"})
-            
-            # Save processed file
-            df.to_csv(output_file, index=False)
+            return pd.DataFrame({
+                'Tile': df_tiles['Name'].to_numpy()[idx],  # Name
+                'X': df_tiles['X'].to_numpy()[idx].astype(np.int64) // 1000,  # X coordinate
+                'Z': df_tiles['Y'].to_numpy()[idx].astype(np.int64) // 1000,  # Y coordinate (as Z)
+                'AT8': df_at8.iloc[:len(idx), 1].to_numpy(),  # AT8 value
+            })
             
         except Exception as e:
-            # If processing fails, just copy the coordinate file
-            import shutil
-            shutil.copy2(coord_file, output_file)
+            # If processing fails, fall back to the coordinate table
+            return df_tiles
+
+
+def _paint_blocks_numpy(mask: np.ndarray, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray,
+                        values: np.ndarray, half_block: int):
+    """Fill a cube of side 2 * half_block + 1 around each centre, clipped to the mask
+    
+    Later tiles overwrite earlier ones where blocks overlap.
+    """
+    nx, ny, nz = mask.shape
+    for x, y, z, value in zip(xs.tolist(), ys.tolist(), zs.tolist(), values.tolist()):
+        mask[max(0, x - half_block):min(nx, x + half_block + 1),
+             max(0, y - half_block):min(ny, y + half_block + 1),
+             max(0, z - half_block):min(nz, z + half_block + 1)] = value
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _paint_blocks_numba(mask, xs, ys, zs, values, half_block):
+        """JIT-compiled equivalent of _paint_blocks_numpy
+        
+        Parallelised over x-planes rather than tiles so that overlapping blocks
+        keep the same last-tile-wins result as the serial version.
+        """
+        nx, ny, nz = mask.shape
+        for i in numba.prange(nx):
+            for t in range(len(xs)):
+                if xs[t] - half_block <= i <= xs[t] + half_block:
+                    for j in range(max(0, ys[t] - half_block), min(ny, ys[t] + half_block + 1)):
+                        for k in range(max(0, zs[t] - half_block), min(nz, zs[t] + half_block + 1)):
+                            mask[i, j, k] = values[t]
+    
+    paint_blocks = _paint_blocks_numba
+else:
+    paint_blocks = _paint_blocks_numpy
+
+
+def _float32_header(header):
+    """Copy a NIfTI header for a derived float32 image
+    
+    The source's display range and description do not apply to the derived
+    image, so they are cleared rather than carried over.
+    """
+    header = header.copy()
+    header.set_data_dtype(np.float32)
+    header['cal_min'] = header['cal_max'] = 0
+    header['descrip'] = b''
+    return header
+
+
+@functools.lru_cache(maxsize=4)
+def _load_all_manual_coords(coords_path: str, mtime_ns: int) -> dict:
+    """Parse the manual coordinates file into {subject_id: "X,Y,Z"}
+    
+    Cached per (path, mtime) so the file is read once per run and edits are
+    picked up. Values are parsed per subject so one malformed line only
+    affects its own subject.
+    """
+    all_coords = {}
+    with open(coords_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#') or not line:
+                continue
+            
+            if '=' in line:
+                subj, coords = line.split('=', 1)
+                all_coords.setdefault(subj.strip(), coords.strip())
+    return all_coords
 
 
 class CoordinateTransformationStep(BaseStep):
     """Step 4: Transform coordinates using manual input and create 3D blocks"""
     
+    cache_config_keys = ['block_size']
+    
     def get_step_suffix(self) -> str:
         return "_transformation"
     
+    def _expected_outputs(self, subject_id: int) -> List[Path]:
+        output_dir = self.config.get_subject_step_dir(subject_id, self.get_step_suffix())
+        return [
+            output_dir / f"{subject_id}_QNP_AT8_mask_block.nii.gz",
+            output_dir / f"{subject_id}_transformed_coordinates.csv"
+        ]
+    
     def _process_subject(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
         """Transform coordinates using manual input and create 3D blocks"""
         try:
@@ -451,12 +676,20 @@ class CoordinateTransformationStep(BaseStep):
             # Create output directory
             output_dir.mkdir(parents=True, exist_ok=True)
             
+            # Reuse outputs from a previous run with identical inputs
+            output_files = self._expected_outputs(subject_id)
+            key = self._output_cache_key([tile_proc_file, upsampled_nii, manual_coords_file])
+            if restore_cached_outputs(self.config, self.get_step_suffix(), key, output_files, logger, force=self._force):
+                logger.info(f"Subject {subject_id}: Restored coordinate transformation outputs from cache")
+                return True
+            
             # Transform coordinates and create 3D blocks
             success = self._create_3d_blocks(
                 subject_id, tile_proc_file, upsampled_nii, manual_coords, output_dir, logger
             )
             
             if success:
+                store_cached_outputs(self.config, self.get_step_suffix(), key, output_files, logger)
                 logger.info(f"Subject {subject_id}: Coordinate transformation completed")
                 return True
             else:
@@ -470,21 +703,14 @@ class CoordinateTransformationStep(BaseStep):
     def _load_manual_coordinates(self, coords_file: Path, subject_id: int, logger: logging.Logger) -> Optional[tuple]:
         """Load manual coordinates for a subject"""
         try:
-            with open(coords_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('#') or not line:
-                        continue
-                    
-                    if '=' in line:
-                        subj, coords = line.split('=', 1)
-                        subj = subj.strip()
-                        if subj == str(subject_id):
-                            x, y, z = map(int, coords.strip().split(','))
-                            logger.info(f"Subject {subject_id}: Manual coordinates X={x}, Y={y}, Z={z}")
-                            return (x, y, z)
+            all_coords = _load_all_manual_coords(str(coords_file), coords_file.stat().st_mtime_ns)
+            coords = all_coords.get(str(subject_id))
+            if coords is None:
+                return None
             
-            return None
+            x, y, z = map(int, coords.split(','))
+            logger.info(f"Subject {subject_id}: Manual coordinates X={x}, Y={y}, Z={z}")
+            return (x, y, z)
             
         except Exception as e:
             logger.error(f"Failed to load manual coordinates for subject {subject_id}: {e}")
@@ -498,78 +724,66 @@ class CoordinateTransformationStep(BaseStep):
             df = pd.read_csv(tile_proc_file)
             logger.info(f"Subject {subject_id}: Loaded {len(df)} tile entries")
             
-            # Load the upsampled NIfTI image
+            # Load the upsampled NIfTI header; only its shape and affine are needed,
+            # so the voxel data is never read
             img = nib.load(str(upsampled_nii))
+            shape = img.header.get_data_shape()
             affine = img.affine
-            logger.info(f"Subject {subject_id}: Image shape {img.shape}")
+            logger.info(f"Subject {subject_id}: Image shape {shape}")
             
-            # Create an empty mask array
-            mask = np.zeros(img.shape)
+            # Create an empty mask array; np.zeros maps zero pages lazily, so only
+            # the pages touched by painted blocks are actually allocated
+            mask = np.zeros(shape, dtype=np.float32)
             
             # Get manual coordinates (offsets)
             x_offset, y_slice, z_offset = manual_coords
             
             # Transform each tile entry
             block_size = self.config.get('block_size', 7)
-            
-            for i in range(len(df)):
-                row = df.iloc[i]
-                tile_name = row['Tile']
-                original_x = row['X']
-                original_z = row['Z']
-                at8_value = row['AT8']
-                
-                # Calculate coordinates in MNI space using offsets
-                # X = Original_X + X_offset
-                # Y = Fixed slice number (Y_slice)
-                # Z = Original_Z + Z_offset
-                x = int(original_x) + x_offset
-                y = y_slice
-                z = int(original_z) + z_offset
-                
-                # Ensure coordinates are within image bounds
-                if (0 <= x < img.shape[0] and 0 <= y < img.shape[1] and 0 <= z < img.shape[2]):
-                    # Create a block around the coordinate
-                    half_block = block_size // 2
-                    for dx in range(-half_block, half_block + 1):
-                        for dy in range(-half_block, half_block + 1):
-                            for dz in range(-half_block, half_block + 1):
-                                nx, ny, nz = x + dx, y + dy, z + dz
-                                if (0 <= nx < img.shape[0] and 
-                                    0 <= ny < img.shape[1] and 
-                                    0 <= nz < img.shape[2]):
-                                    mask[nx, ny, nz] = at8_value
-                    
-                    logger.debug(f"Subject {subject_id}: Placed block for {tile_name} at ({x},{y},{z}) with AT8={at8_value}")
-                else:
-                    logger.warning(f"Subject {subject_id}: Coordinates ({x},{y},{z}) out of bounds for {tile_name}")
+            half_block = block_size // 2
+            
+            # Calculate coordinates in MNI space using offsets
+            # X = Original_X + X_offset
+            # Y = Fixed slice number (Y_slice)
+            # Z = Original_Z + Z_offset
+            tile_names = df['Tile'].to_numpy()
+            xs = df['X'].to_numpy(dtype=np.int64) + x_offset
+            ys = np.full_like(xs, y_slice)
+            zs = df['Z'].to_numpy(dtype=np.int64) + z_offset
+            at8_values = df['AT8'].to_numpy(dtype=np.float64)
+            
+            # Ensure coordinates are within image bounds
+            in_bounds = ((0 <= xs) & (xs < shape[0]) &
+                         (0 <= ys) & (ys < shape[1]) &
+                         (0 <= zs) & (zs < shape[2]))
+            for i in np.flatnonzero(~in_bounds):
+                logger.warning(f"Subject {subject_id}: Coordinates ({xs[i]},{ys[i]},{zs[i]}) out of bounds for {tile_names[i]}")
+            
+            # Create a block around each coordinate, clipped to the image; only the
+            # mask is float32, the CSV keeps the original float64 values
+            paint_blocks(mask, xs[in_bounds], ys[in_bounds], zs[in_bounds],
+                         at8_values[in_bounds].astype(np.float32), half_block)
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                for i in np.flatnonzero(in_bounds):
+                    logger.debug("Subject %s: Placed block for %s at (%s,%s,%s) with AT8=%s",
+                                 subject_id, tile_names[i], xs[i], ys[i], zs[i], at8_values[i])
             
             # Save the 3D mask
             output_mask = output_dir / f"{subject_id}_QNP_AT8_mask_block.nii.gz"
-            nifti_img = nib.Nifti1Image(mask, affine=affine)
-            nib.save(nifti_img, str(output_mask))
+            nifti_img = nib.Nifti1Image(mask, affine=affine, header=_float32_header(img.header))
+            nifti_img.to_filename(str(output_mask))
             
             # Save transformed coordinates
             output_coords = output_dir / f"{subject_id}_transformed_coordinates.csv"
-            transformed_data = []
-            for i in range(len(df)):
-                row = df.iloc[i]
-                original_x = row['X']
-                original_z = row['Z']
-                x = int(original_x) + x_offset
-                y = y_slice
-                z = int(original_z) + z_offset
-                
-                transformed_data.append({
-                    'Tile': row['Tile'],
-                    'X': x,
-                    'Y': y,
-                    'Z': z,
-                    'AT8': row['AT8']
-                })
-            
-            df_transformed = pd.DataFrame(transformed_data)
-            df_transformed.to_csv(output_coords, index=False)
+            df_transformed = pd.DataFrame({
+                'Tile': tile_names,
+                'X': xs,
+                'Y': ys,
+                'Z': zs,
+                'AT8': at8_values
+            })
+            _write_csv(df_transformed, output_coords)
             
             logger.info(f"Subject {subject_id}: Created 3D mask with {len(df)} blocks")
             logger.info(f"Subject {subject_id}: Saved mask to {output_mask}")
@@ -591,15 +805,26 @@ class KernelApplicationStep(BaseStep):
     def get_step_suffix(self) -> str:
         return "_kernel"
     
+    def _expected_outputs(self, subject_id: int) -> List[Path]:
+        output_dir = self.config.get_subject_step_dir(subject_id, self.get_step_suffix())
+        return [output_dir / f"{subject_id}_QNP_AT8_smoothed_sig2.nii.gz"]
+    
+    def _get_aligned_block_file(self, subject_id: int) -> Path:
+        """Get the aligned block produced by the manual alignment of the transformation output"""
+        transformation_dir = self.config.get_subject_step_dir(subject_id, '_transformation')
+        return transformation_dir / f"{subject_id}_QNP_AT8_mask_block_aligned.nii.gz"
+    
+    def _prefetch_inputs(self, subject_id: int):
+        prefetch_file(self._get_aligned_block_file(subject_id))
+    
     def _process_subject(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
         try:
             # Input: aligned block from transformation step
-            transformation_dir = Path(self.config.get('output_base', 'output')) / subject_id / f"{subject_id}_transformation"
-            aligned_block_file = transformation_dir / f"{subject_id}_QNP_AT8_mask_block_aligned.nii.gz"
+            aligned_block_file = self._get_aligned_block_file(subject_id)
             
             # Output: smoothed block (save in separate kernel directory)
-            output_dir = Path(self.config.get('output_base', 'output')) / subject_id / f"{subject_id}_kernel"
-            output_file = output_dir / f"{subject_id}_QNP_AT8_smoothed_sig2.nii.gz"
+            output_dir = self.config.get_subject_step_dir(subject_id, '_kernel')
+            output_file, = self._expected_outputs(subject_id)
             
             if dry_run:
                 logger.info(f"Subject {subject_id}: Would apply 2mm kernel to {aligned_block_file} -> {output_file}")
@@ -608,8 +833,8 @@ class KernelApplicationStep(BaseStep):
             # Create output directory
             output_dir.mkdir(parents=True, exist_ok=True)
             
-            # Check if output already exists
-            if output_file.exists():
+            # Check if output already exists (--force recomputes it)
+            if output_file.exists() and not self._force:
                 logger.info(f"Subject {subject_id}: Kernel output already exists - {output_file}")
                 return True
             
@@ -620,10 +845,17 @@ class KernelApplicationStep(BaseStep):
                 logger.error(f"See manual_alignment_instructions.md for details")
                 return False
             
+            # Reuse the output from a previous run with an identical input
+            key = self._output_cache_key([aligned_block_file])
+            if restore_cached_outputs(self.config, self.get_step_suffix(), key, [output_file], logger, force=self._force):
+                logger.info(f"Subject {subject_id}: Restored kernel output from cache - {output_file}")
+                return True
+            
             # Apply 2mm Gaussian kernel
             success = self._apply_kernel(aligned_block_file, output_file, logger)
             
             if success:
+                store_cached_outputs(self.config, self.get_step_suffix(), key, [output_file], logger)
                 logger.info(f"Subject {subject_id}: 2mm kernel applied successfully")
                 logger.info(f"Subject {subject_id}: Output saved to {output_file}")
             else:
@@ -638,32 +870,39 @@ class KernelApplicationStep(BaseStep):
     def _apply_kernel(self, input_file: Path, output_file: Path, logger: logging.Logger) -> bool:
         """Apply 2mm Gaussian kernel to the aligned block"""
         try:
-            from scipy.ndimage import gaussian_filter
+            from scipy.ndimage import gaussian_filter1d
             
-            # Load the aligned QNP mask
+            # Load the aligned QNP mask, starting readahead of the whole file first
+            prefetch_file(input_file)
             img = nib.load(str(input_file))
             
-            # Get the data array and affine from the image
-            data = img.get_fdata()
-            logger.debug(f"Data shape: {data.shape}")
+            # Get the data array and affine from the image (float32, no float64 upcast)
+            data = np.asarray(img.dataobj, dtype=np.float32)
+            if not data.flags.writeable:
+                data = data.copy()
+            logger.debug("Data shape: %s", data.shape)
             affine = img.affine
             
-            # Apply a 2mm Gaussian kernel to the data
-            data_smoothed = gaussian_filter(data, sigma=2)
+            # Apply a 2mm Gaussian kernel to the data as separable 1D passes,
+            # alternating between two buffers instead of allocating one per axis
+            # (same reflect mode and truncation as gaussian_filter)
+            src, dst = data, np.empty_like(data)
+            for axis in range(data.ndim):
+                gaussian_filter1d(src, sigma=2, axis=axis, output=dst)
+                src, dst = dst, src
+            data_smoothed = src
             
-            # Create a threshold mask
-            mask = (data_smoothed > 0.01).astype(int)
+            # Zero out everything below the threshold in place
+            np.multiply(data_smoothed, data_smoothed > 0.01, out=data_smoothed)
             
-            # Apply the mask to the smoothed data
-            data_smoothed_masked = data_smoothed * mask
-            
-            # Create a new Nifti image with the masked smoothed data
-            nifti_img_smoothed_masked = nib.Nifti1Image(data_smoothed_masked, affine=affine)
+            # Create a new Nifti image with the masked smoothed data, stored as float32
+            nifti_img_smoothed_masked = nib.Nifti1Image(data_smoothed, affine=affine,
+                                                        header=_float32_header(img.header))
             
             # Save the masked smoothed image
             nib.save(nifti_img_smoothed_masked, str(output_file))
             
-            logger.debug(f"Kernel application completed: {output_file}")
+            logger.debug("Kernel application completed: %s", output_file)
             return True
             
         except Exception as e:
@@ -675,43 +914,120 @@ class KernelApplicationStep(BaseStep):
 class MNIRegistrationStep:
     """Step 6: Register native brain to MNI 2009b and transform kernel blocks"""
     
+    # Bump when a change to the registration or transform alters their outputs
+    cache_version = '1'
+    
     def __init__(self, config):
         self.config = config
+        # Set from execute(); --force also bypasses the ANTs output cache
+        self._force = False
+        # Threads per ANTs process; recomputed in execute() from the number of parallel jobs
+        self._ants_threads = 4
+        # Resolved once per run in execute()
+        self._mni_template: Optional[Path] = None
+        # Whether the template gets antsRegistrationSyN.sh's large-image schedule; read on first use
+        self._template_is_large: Optional[bool] = None
+        # ANTsPy module, imported on the first kernel transform (False if unavailable)
+        self._ants = None
+        # Template loaded by ANTsPy on the first kernel transform, shared by all subjects
+        self._mni_img = None
+        # ANTsPy transforms run one at a time: ITK's in-process thread pool already
+        # uses every core, and _ants_env() only limits subprocesses
+        self._antspy_lock = threading.Lock()
     
     def execute(self, subjects: List[int], force: bool = False, dry_run: bool = False, logger: Optional[logging.Logger] = None) -> bool:
         """Execute MNI registration for all subjects"""
         if logger is None:
             logger = logging.getLogger(__name__)
+        self._force = force
         
-        success_count = 0
-        for subject_id in subjects:
-            if self._process_subject(subject_id, dry_run, logger):
-                success_count += 1
+        # Skip subjects that already have transforms and a transformed kernel block
+        subjects = self._remaining_subjects(subjects, force, logger)
+        if not subjects:
+            logger.info("No subjects to process")
+            return True
+        
+        # Split the CPUs between parallel registrations so threads x jobs don't oversubscribe
+        n_jobs = max(1, min(int(self.config.get('mni_parallel_jobs', 1)), len(subjects)))
+        default_threads = max(1, min(4, (os.cpu_count() or 1) // n_jobs))
+        self._ants_threads = int(self.config.get('ants_threads', default_threads))
+        
+        # The template is shared by all subjects: resolve and check it once
+        self._mni_template = self._resolve_mni_template()
+        if not dry_run and not self._mni_template.exists():
+            logger.error(f"MNI template not found - {self._mni_template}")
+            return False
+        
+        if n_jobs > 1 and not dry_run:
+            logger.info(f"Registering {len(subjects)} subjects with {n_jobs} parallel jobs "
+                        f"({self._ants_threads} threads each)")
+        success_count = asyncio.run(self._process_subjects_async(subjects, n_jobs, dry_run, logger))
         
         logger.info(f"{self.__class__.__name__}: {success_count}/{len(subjects)} subjects successful")
         return success_count == len(subjects)
     
-    def _process_subject(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
+    async def _process_subjects_async(self, subjects: List[int], n_jobs: int, dry_run: bool, logger: logging.Logger) -> int:
+        """Process subjects with at most n_jobs ANTs pipelines running at once"""
+        semaphore = asyncio.Semaphore(n_jobs)
+        
+        async def process_one(subject_id: int) -> bool:
+            async with semaphore:
+                return await self._process_subject_async(subject_id, dry_run, logger)
+        
+        results = await asyncio.gather(*(process_one(subject_id) for subject_id in subjects), return_exceptions=True)
+        for subject_id, result in zip(subjects, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Subject {subject_id}: MNI registration failed - {result}")
+        return sum(result is True for result in results)
+    
+    def _remaining_subjects(self, subjects: List[int], force: bool, logger: logging.Logger) -> List[int]:
+        """Filter out subjects whose registration outputs all exist
+        
+        Args:
+            subjects: List of subject IDs
+            force: Keep every subject
+            logger: Logger instance
+        
+        Returns:
+            Subjects that still need registration or kernel transformation
+        """
+        if force:
+            return subjects
+        expected = {}
+        for subject_id in subjects:
+            output_dir = self.config.get_subject_step_dir(subject_id, '_mni_registration')
+            expected[subject_id] = (self._get_transform_files(subject_id, output_dir)
+                                    + [output_dir / f"{subject_id}_QNP_mask_ToMNI.nii.gz"])
+        existing = find_complete_subjects(expected)
+        if existing:
+            logger.info(f"Skipping {len(existing)} subjects with complete MNI registration outputs")
+        return [s for s in subjects if s not in existing]
+    
+    def _resolve_mni_template(self) -> Path:
+        """Get the MNI template - config first, then default locations"""
+        mni_template_path = self.config.get('mni_template_path', None)
+        if mni_template_path:
+            return Path(mni_template_path)
+        # Try common locations
+        mni_template = Path("Input/mni_icbm152_t1_nlin_sym_09b_hires_stripped.nii.gz")
+        if not mni_template.exists():
+            mni_template = Path("../V1/Cov_dev/mni_icbm152_t1_nlin_sym_09b_hires_stripped.nii.gz")
+        return mni_template
+    
+    async def _process_subject_async(self, subject_id: int, dry_run: bool, logger: logging.Logger) -> bool:
         try:
             # Input files
-            upsampled_dir = Path(self.config.get('output_base', 'output')) / subject_id / f"{subject_id}_upsampled"
+            upsampled_dir = self.config.get_subject_step_dir(subject_id, '_upsampled')
             native_brain = upsampled_dir / f"{subject_id}_001_up_re.nii.gz"
             
-            kernel_dir = Path(self.config.get('output_base', 'output')) / subject_id / f"{subject_id}_kernel"
+            kernel_dir = self.config.get_subject_step_dir(subject_id, '_kernel')
             kernel_block = kernel_dir / f"{subject_id}_QNP_AT8_smoothed_sig2.nii.gz"
             
-            # MNI template - check config first, then default locations
-            mni_template_path = self.config.get('mni_template_path', None)
-            if mni_template_path:
-                mni_template = Path(mni_template_path)
-            else:
-                # Try common locations
-                mni_template = Path("Input/mni_icbm152_t1_nlin_sym_09b_hires_stripped.nii.gz")
-                if not mni_template.exists():
-                    mni_template = Path("../V1/Cov_dev/mni_icbm152_t1_nlin_sym_09b_hires_stripped.nii.gz")
+            # MNI template, resolved and checked once in execute()
+            mni_template = self._mni_template
             
             # Output directory
-            output_dir = Path(self.config.get('output_base', 'output')) / subject_id / f"{subject_id}_mni_registration"
+            output_dir = self.config.get_subject_step_dir(subject_id, '_mni_registration')
             
             if dry_run:
                 logger.info(f"Subject {subject_id}: Would register to MNI -> {output_dir}")
@@ -729,17 +1045,13 @@ class MNIRegistrationStep:
                 logger.error(f"Subject {subject_id}: Kernel block file not found - {kernel_block}")
                 return False
             
-            if not mni_template.exists():
-                logger.error(f"Subject {subject_id}: MNI template not found - {mni_template}")
-                return False
-            
             # Step 1: Register native brain to MNI
-            success = self._register_to_mni(subject_id, native_brain, mni_template, output_dir, logger)
+            success = await self._register_to_mni(subject_id, native_brain, mni_template, output_dir, logger)
             if not success:
                 return False
             
             # Step 2: Transform kernel block to MNI space
-            success = self._transform_kernel_to_mni(subject_id, kernel_block, mni_template, output_dir, logger)
+            success = await self._transform_kernel_to_mni(subject_id, kernel_block, mni_template, output_dir, logger)
             if not success:
                 return False
             
@@ -750,98 +1062,296 @@ class MNIRegistrationStep:
             logger.error(f"Subject {subject_id}: MNI registration failed - {e}")
             return False
     
-    def _register_to_mni(self, subject_id: int, native_brain: Path, mni_template: Path, output_dir: Path, logger: logging.Logger) -> bool:
+    def _ants_env(self) -> dict:
+        """Environment for ANTs subprocesses with the ITK thread count pinned"""
+        env = os.environ.copy()
+        env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(self._ants_threads)
+        return env
+    
+    def _ants_stderr_path(self, subject_id: int, output_dir: Path, label: str) -> Path:
+        """File that an ANTs command's stderr is written to, kept for inspecting failed runs"""
+        return output_dir / f"{subject_id}_{label}.stderr"
+    
+    def _get_transform_type(self) -> str:
+        """Get the ANTs transform type: 's' (SyN), 'b' (BSplineSyN) or 'a' (affine only)"""
+        return str(self.config.get('ants_transform_type', 's'))
+    
+    def _get_transform_files(self, subject_id: int, output_dir: Path) -> List[Path]:
+        """Get the transforms written by _register_to_mni, in antsApplyTransforms order
+        
+        Args:
+            subject_id: Subject ID
+            output_dir: MNI registration output directory
+        
+        Returns:
+            Warp field (unless affine only) followed by the affine transform
+        """
+        transforms = [output_dir / f"{subject_id}_0GenericAffine.mat"]
+        if self._get_transform_type() != 'a':
+            transforms.insert(0, output_dir / f"{subject_id}_1Warp.nii.gz")
+        return transforms
+    
+    def _registration_params(self) -> dict:
+        """ANTs registration settings that the ANTs output cache is keyed on"""
+        keys = ['ants_transform_type', 'ants_affine_iterations', 'ants_reg_iterations',
+                'ants_linear_shrink_factors', 'ants_linear_smoothing_sigmas',
+                'ants_syn_shrink_factors', 'ants_syn_smoothing_sigmas',
+                'ants_metric_sampling', 'ants_syn_metric']
+        return {key: self.config.get(key) for key in keys}
+    
+    async def _ants_cache_key(self, inputs: List[Path], params: dict) -> str:
+        """Hash the ANTs inputs off the event loop so other subjects keep running"""
+        params = dict(params, cache_version=self.cache_version)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, content_cache_key, inputs, params)
+    
+    def _default_schedule(self, mni_template: Path) -> dict:
+        """Get antsRegistrationSyN.sh's iteration and pyramid schedule for a fixed image
+        
+        Like the wrapper, switches to its large-image schedule (coarser pyramids and
+        an extra SyN level) when any dimension of the fixed image exceeds 256 voxels,
+        as the 0.5mm MNI template does. Only the header is read, once per template.
+        
+        Args:
+            mni_template: Fixed image
+        
+        Returns:
+            Default value for each registration schedule config key
+        """
+        if self._template_is_large is None:
+            shape = nib.load(str(mni_template)).header.get_data_shape()
+            self._template_is_large = any(dim > 256 for dim in shape[:3])
+        if self._template_is_large:
+            return {
+                'ants_affine_iterations': '1000x500x250x100',
+                'ants_linear_shrink_factors': '12x8x4x2',
+                'ants_linear_smoothing_sigmas': '4x3x2x1',
+                'ants_reg_iterations': '100x100x70x50x20',
+                'ants_syn_shrink_factors': '10x6x4x2x1',
+                'ants_syn_smoothing_sigmas': '5x3x2x1x0',
+            }
+        return {
+            'ants_affine_iterations': '1000x500x250x100',
+            'ants_linear_shrink_factors': '8x4x2x1',
+            'ants_linear_smoothing_sigmas': '3x2x1x0',
+            'ants_reg_iterations': '100x70x50x20',
+            'ants_syn_shrink_factors': '8x4x2x1',
+            'ants_syn_smoothing_sigmas': '3x2x1x0',
+        }
+    
+    def _build_registration_cmd(self, native_brain: Path, mni_template: Path, output_prefix: str) -> List[str]:
+        """Build a Rigid -> Affine -> (BSpline)SyN antsRegistration command
+        
+        Mirrors the stages of antsRegistrationSyN.sh in a single antsRegistration
+        process, so the images are loaded and ITK initialised once for all stages.
+        Iterations, shrink factors and smoothing sigmas (separately for the linear
+        and SyN stages), metric sampling and the deformable-stage metric are taken
+        from the configuration. Unset values fall back to antsRegistrationSyN.sh's
+        schedule for the template size (see _default_schedule) and CC with radius 4
+        for the SyN stage.
+        
+        Args:
+            native_brain: Moving image
+            mni_template: Fixed image
+            output_prefix: Output prefix for transforms and warped images
+        
+        Returns:
+            Command line for antsRegistration
+        """
+        fixed, moving = str(mni_template), str(native_brain)
+        transform_type = self._get_transform_type()
+        schedule = {key: self.config.get(key, default)
+                    for key, default in self._default_schedule(mni_template).items()}
+        sampling = self.config.get('ants_metric_sampling', 0.25)
+        syn_metric_type = str(self.config.get('ants_syn_metric', 'CC')).upper()
+        
+        linear_metric = f"MI[{fixed},{moving},1,32,Regular,{sampling}]"
+        if syn_metric_type == 'MI':
+            syn_metric = f"MI[{fixed},{moving},1,32]"
+        else:
+            syn_metric = f"CC[{fixed},{moving},1,4]"
+        linear_schedule = (schedule['ants_affine_iterations'], schedule['ants_linear_shrink_factors'],
+                           schedule['ants_linear_smoothing_sigmas'])
+        syn_schedule = (schedule['ants_reg_iterations'], schedule['ants_syn_shrink_factors'],
+                        schedule['ants_syn_smoothing_sigmas'])
+        stages = [
+            ("Rigid[0.1]", linear_metric, linear_schedule),
+            ("Affine[0.1]", linear_metric, linear_schedule),
+        ]
+        if transform_type == 's':
+            stages.append(("SyN[0.1,3,0]", syn_metric, syn_schedule))
+        elif transform_type == 'b':
+            stages.append(("BSplineSyN[0.1,26,0,3]", syn_metric, syn_schedule))
+        
+        cmd = [
+            "antsRegistration",
+            "--dimensionality", "3",
+            "--float", "0",
+            "--collapse-output-transforms", "1",
+            # Only the forward warped image is written; nothing downstream reads InverseWarped
+            "--output", f"[{output_prefix},{output_prefix}Warped.nii.gz]",
+            "--interpolation", "Linear",
+            "--use-histogram-matching", "0",
+            "--winsorize-image-intensities", "[0.005,0.995]",
+            "--initial-moving-transform", f"[{fixed},{moving},1]"
+        ]
+        for transform, metric, (iterations, shrink_factors, smoothing_sigmas) in stages:
+            cmd += [
+                "--transform", transform,
+                "--metric", metric,
+                "--convergence", f"[{iterations},1e-6,10]",
+                "--shrink-factors", str(shrink_factors),
+                "--smoothing-sigmas", f"{smoothing_sigmas}vox"
+            ]
+        return cmd
+    
+    async def _register_to_mni(self, subject_id: int, native_brain: Path, mni_template: Path, output_dir: Path, logger: logging.Logger) -> bool:
         """Register native brain to MNI using ANTs"""
         try:
-            # Define output prefix
-            output_prefix = output_dir / f"{subject_id}"
-            
-            # Check if transformation files already exist
-            forward_transform = output_dir / f"{subject_id}_0GenericAffine.mat"
-            warp_transform = output_dir / f"{subject_id}_1Warp.nii.gz"
+            # Define output prefix (transforms are written as {subject_id}_0GenericAffine.mat etc.);
+            # ANTs runs with cwd=output_dir, so every path it is given must be absolute
+            output_prefix = str(output_dir.resolve() / f"{subject_id}_")
             
-            if forward_transform.exists() and warp_transform.exists():
+            # Check if transformation files already exist (--force recomputes them)
+            if not self._force and all(transform.exists() for transform in self._get_transform_files(subject_id, output_dir)):
                 logger.info(f"Subject {subject_id}: Transformation files already exist")
                 return True
             
+            if self._get_transform_type() not in ('s', 'b', 'a'):
+                logger.error(f"Subject {subject_id}: Unknown ants_transform_type '{self._get_transform_type()}' (expected s, b or a)")
+                return False
+            
+            # Registration is keyed on image contents: identical inputs skip ANTs entirely
+            transforms = self._get_transform_files(subject_id, output_dir)
+            key = await self._ants_cache_key([native_brain, mni_template], self._registration_params())
+            if restore_cached_outputs(self.config, '_mni_registration', key, transforms, logger, force=self._force):
+                logger.info(f"Subject {subject_id}: Restored ANTs transforms from cache")
+                return True
+            
             # Run ANTs registration
-            cmd = [
-                "antsRegistrationSyN.sh",
-                "-d", "3",
-                "-f", str(mni_template),
-                "-m", str(native_brain),
-                "-o", str(output_prefix),
-                "-n", "4"
-            ]
+            cmd = self._build_registration_cmd(native_brain.resolve(), mni_template.resolve(), output_prefix)
             
             logger.info(f"Subject {subject_id}: Running ANTs registration...")
-            logger.debug(f"Command: {' '.join(cmd)}")
             
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=output_dir)
+            returncode, stderr = await run_command_async(cmd, logger, cwd=output_dir, env=self._ants_env(),
+                                                         stderr_path=self._ants_stderr_path(subject_id, output_dir, 'ants'))
             
-            if result.returncode == 0:
+            if returncode == 0:
+                store_cached_outputs(self.config, '_mni_registration', key, transforms, logger)
                 logger.info(f"Subject {subject_id}: ANTs registration completed successfully")
                 return True
             else:
                 logger.error(f"Subject {subject_id}: ANTs registration failed")
-                logger.error(f"stdout: {result.stdout}")
-                logger.error(f"stderr: {result.stderr}")
+                logger.error("stderr: " + "\n".join(stderr))
                 return False
                 
         except Exception as e:
             logger.error(f"Subject {subject_id}: ANTs registration error - {e}")
             return False
     
-    def _transform_kernel_to_mni(self, subject_id: int, kernel_block: Path, mni_template: Path, output_dir: Path, logger: logging.Logger) -> bool:
+    async def _transform_kernel_to_mni(self, subject_id: int, kernel_block: Path, mni_template: Path, output_dir: Path, logger: logging.Logger) -> bool:
         """Transform kernel block to MNI space using ANTs transforms"""
         try:
             # Define transformation files
-            forward_transform = output_dir / f"{subject_id}_0GenericAffine.mat"
-            warp_transform = output_dir / f"{subject_id}_1Warp.nii.gz"
+            transforms = self._get_transform_files(subject_id, output_dir)
             
             # Define output file
             output_transformed = output_dir / f"{subject_id}_QNP_mask_ToMNI.nii.gz"
             
-            # Check if output already exists
-            if output_transformed.exists():
+            # Check if output already exists (--force recomputes it)
+            if output_transformed.exists() and not self._force:
                 logger.info(f"Subject {subject_id}: Transformed kernel block already exists")
                 return True
             
             # Check if transformation files exist
-            if not forward_transform.exists():
-                logger.error(f"Subject {subject_id}: Forward transform not found - {forward_transform}")
-                return False
+            for transform in transforms:
+                if not transform.exists():
+                    logger.error(f"Subject {subject_id}: Transform not found - {transform}")
+                    return False
+            
+            key = await self._ants_cache_key([kernel_block, mni_template] + transforms,
+                                             {'interpolation': 'NearestNeighbor'})
+            if restore_cached_outputs(self.config, '_mni_transform', key, [output_transformed], logger, force=self._force):
+                logger.info(f"Subject {subject_id}: Restored transformed kernel block from cache")
+                return True
             
-            if not warp_transform.exists():
-                logger.error(f"Subject {subject_id}: Warp transform not found - {warp_transform}")
-                return False
+            logger.info(f"Subject {subject_id}: Applying ANTs transforms to kernel block...")
+            
+            if self._load_antspy() is not None:
+                try:
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self._apply_transforms_antspy,
+                                               kernel_block, transforms, output_transformed)
+                    store_cached_outputs(self.config, '_mni_transform', key, [output_transformed], logger)
+                    logger.info(f"Subject {subject_id}: Kernel block transformed to MNI space successfully")
+                    return True
+                except Exception as e:
+                    logger.warning(f"Subject {subject_id}: ANTsPy transform failed, falling back to antsApplyTransforms - {e}")
             
-            # Run ANTs transform
+            # Run ANTs transform (absolute paths, since it runs with cwd=output_dir)
             cmd = [
                 "antsApplyTransforms",
                 "-d", "3",
-                "-i", str(kernel_block),
-                "-r", str(mni_template),
-                "-o", str(output_transformed),
-                "-n", "NearestNeighbor",
-                "-t", str(warp_transform),
-                "-t", str(forward_transform)
+                "-i", str(kernel_block.resolve()),
+                "-r", str(mni_template.resolve()),
+                "-o", str(output_transformed.resolve()),
+                "-n", "NearestNeighbor"
             ]
+            for transform in transforms:
+                cmd += ["-t", str(transform.resolve())]
             
-            logger.info(f"Subject {subject_id}: Applying ANTs transforms to kernel block...")
-            logger.debug(f"Command: {' '.join(cmd)}")
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=output_dir)
+            returncode, stderr = await run_command_async(cmd, logger, cwd=output_dir, env=self._ants_env(),
+                                                         stderr_path=self._ants_stderr_path(subject_id, output_dir, 'ants_transform'))
             
-            if result.returncode == 0:
+            if returncode == 0:
+                store_cached_outputs(self.config, '_mni_transform', key, [output_transformed], logger)
                 logger.info(f"Subject {subject_id}: Kernel block transformed to MNI space successfully")
                 return True
             else:
                 logger.error(f"Subject {subject_id}: ANTs transform failed")
-                logger.error(f"stdout: {result.stdout}")
-                logger.error(f"stderr: {result.stderr}")
+                logger.error("stderr: " + "\n".join(stderr))
                 return False
                 
         except Exception as e:
             logger.error(f"Subject {subject_id}: ANTs transform error - {e}")
             return False
+    
+    def _load_antspy(self):
+        """Import ANTsPy on first use, so runs that never transform a kernel block don't pay for it
+        
+        Returns:
+            The ants module, or None to fall back to the antsApplyTransforms CLI
+        """
+        if self._ants is None:
+            try:
+                import ants
+                self._ants = ants
+            except ImportError:
+                self._ants = False
+        return self._ants or None
+    
+    def _apply_transforms_antspy(self, kernel_block: Path, transforms: List[Path], output_transformed: Path):
+        """Resample the kernel block into MNI space in-process with ANTsPy
+        
+        Equivalent to the antsApplyTransforms call in _transform_kernel_to_mni, but
+        the template is read once, on the first subject not served from the cache,
+        and reused for the rest. Calls are serialised so concurrent subjects do not
+        each start an all-core ITK thread pool.
+        
+        Args:
+            kernel_block: Kernel block in native space
+            transforms: Transforms in antsApplyTransforms order
+            output_transformed: Output file in MNI space
+        """
+        ants = self._ants
+        with self._antspy_lock:
+            if self._mni_img is None:
+                self._mni_img = ants.image_read(str(self._mni_template))
+            moving = ants.image_read(str(kernel_block))
+            transformed = ants.apply_transforms(
+                fixed=self._mni_img,
+                moving=moving,
+                transformlist=[str(transform) for transform in transforms],
+                interpolator='nearestNeighbor'
+            )
+            ants.image_write(transformed, str(output_transformed))
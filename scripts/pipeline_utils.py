@@ -4,11 +4,66 @@ Configuration handling, logging, and validation functions
 """
 
 import os
-import sys
+import re
+import json
+import math
+import time
+import shlex
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import functools
 import logging
+import logging.handlers
+from collections import deque
 from pathlib import Path
-from typing import List, Optional, Dict, Any
-import subprocess
+from typing import List, Optional, Dict, Any, Tuple
+
+
+# key = value, with optional whitespace and an optional trailing # comment
+_CONFIG_LINE = re.compile(r'^\s*([^=#\s]+)\s*=\s*(.*?)\s*(?:#.*)?$')
+# Blank lines and full-line comments
+_CONFIG_SKIP = re.compile(r'^\s*(?:#.*)?$')
+_CONFIG_BOOLS = {'true': True, 'false': False}
+
+
+def _parse_number(value: str):
+    """Parse an int or finite float config value, returning None for anything else"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _parse_bool(value: str):
+    """Parse a true/false config value (case-insensitive), returning None for anything else"""
+    return _CONFIG_BOOLS.get(value.lower())
+
+
+def _parse_list(value: str):
+    """Parse a comma-separated config value, returning None if there is no comma"""
+    if ',' not in value:
+        return None
+    return [item.strip() for item in value.split(',')]
+
+
+# Converters tried in order; the first one that does not return None wins
+_CONFIG_CONVERTERS = (_parse_number, _parse_bool, _parse_list)
+
+
+def _parse_value(value: str):
+    """Convert a raw config value to int, float, bool, list or str"""
+    for converter in _CONFIG_CONVERTERS:
+        parsed = converter(value)
+        if parsed is not None:
+            return parsed
+    return value
 
 
 class PipelineConfig:
@@ -22,36 +77,42 @@ class PipelineConfig:
         """
         self.config_path = config_path
         self.config = self._load_config()
+        
+        # Resolve frequently used directories once
+        self._output_base = Path(self.get('output_base', 'output'))
+        self._mgz_dir = Path(self.get('input_mgz_images', 'Input/exvivo_transformed'))
+        self._annotation_dir = Path(self.get('input_halo_annotations', 'Input/Halo_extract/Annotations'))
+        
+        # Per-subject paths, keyed on the subject ID as a string so that config
+        # (str) and CLI (int) IDs share entries
+        self._path_cache: Dict[tuple, Any] = {}
     
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from text file"""
         try:
             config = {}
             with open(self.config_path, 'r') as f:
-                for line_num, line in enumerate(f, 1):
-                    line = line.strip()
-                    # Skip empty lines and comments
-                    if not line or line.startswith('#'):
-                        continue
-                    # Parse key=value pairs
-                    if '=' in line:
-                        key, value = line.split('=', 1)
-                        key = key.strip()
-                        value = value.strip()
-                        # Convert common value types
-                        if value.lower() in ['true', 'false']:
-                            value = value.lower() == 'true'
-                        elif value.replace('.', '').isdigit():
-                            value = float(value) if '.' in value else int(value)
-                        elif ',' in value:
-                            value = [item.strip() for item in value.split(',')]
-                        config[key] = value
-                    else:
-                        print(f"Warning: Invalid config line {line_num}: {line}")
+                lines = f.read().splitlines()
+            for line_num, line in enumerate(lines, 1):
+                # Parse key=value pairs, dropping inline comments
+                match = _CONFIG_LINE.match(line)
+                if match:
+                    key, value = match.groups()
+                    config[key] = _parse_value(value)
+                elif not _CONFIG_SKIP.match(line):
+                    print(f"Warning: Invalid config line {line_num}: {line.strip()}")
             return config
         except Exception as e:
             raise RuntimeError(f"Failed to load configuration from {self.config_path}: {e}")
     
+    def _cached(self, key: tuple, build):
+        """Return the memoized value for key, building it on first use"""
+        try:
+            return self._path_cache[key]
+        except KeyError:
+            value = self._path_cache[key] = build()
+            return value
+    
     def get(self, key_path: str, default=None):
         """Get configuration value using dot notation
         
@@ -86,6 +147,30 @@ class PipelineConfig:
             return [int(s.strip()) for s in subject_list.split(',')]
         return subject_list
     
+    def get_max_workers(self, n_subjects: Optional[int] = None) -> int:
+        """Get number of worker processes for per-subject parallelism
+        
+        Args:
+            n_subjects: Optional number of subjects, used to cap the worker count
+        
+        Returns:
+            Number of workers (1 when parallel_processing is disabled)
+        """
+        if not self.get('parallel_processing', False):
+            return 1
+        max_workers = int(self.get('max_workers', os.cpu_count() or 1))
+        if n_subjects is not None:
+            max_workers = min(max_workers, n_subjects)
+        return max(1, max_workers)
+    
+    def get_output_base(self) -> Path:
+        """Get the base output directory
+        
+        Returns:
+            Path to output base directory
+        """
+        return self._output_base
+    
     def get_subject_output_dir(self, subject_id: int) -> Path:
         """Get the output directory for a specific subject
         
@@ -95,8 +180,7 @@ class PipelineConfig:
         Returns:
             Path to subject output directory
         """
-        output_base = self.get('output_base', 'output')
-        return Path(output_base) / str(subject_id)
+        return self._cached(('output', str(subject_id)), lambda: self._output_base / str(subject_id))
     
     def get_subject_step_dir(self, subject_id: int, step_suffix: str) -> Path:
         """Get the step-specific directory for a subject
@@ -108,8 +192,8 @@ class PipelineConfig:
         Returns:
             Path to step-specific directory
         """
-        subject_dir = self.get_subject_output_dir(subject_id)
-        return subject_dir / f"{subject_id}{step_suffix}"
+        return self._cached(('step', str(subject_id), step_suffix),
+                            lambda: self.get_subject_output_dir(subject_id) / f"{subject_id}{step_suffix}")
     
     def get_input_mgz_path(self, subject_id: int) -> Path:
         """Get input MGZ file path for a subject
@@ -120,11 +204,12 @@ class PipelineConfig:
         Returns:
             Path to input MGZ file
         """
-        mgz_dir = self.get('input_mgz_images', 'Input/exvivo_transformed')
-        mgz_filename = self.get('mgz_filename', '001.mgz')
-        subject_suffix = self.get('subject_suffix', 'X')
+        def build():
+            mgz_filename = self.get('mgz_filename', '001.mgz')
+            subject_suffix = self.get('subject_suffix', 'X')
+            return self._mgz_dir / f"{subject_id}{subject_suffix}" / mgz_filename
         
-        return Path(mgz_dir) / f"{subject_id}{subject_suffix}" / mgz_filename
+        return self._cached(('mgz', str(subject_id)), build)
     
     def get_input_annotation_path(self, subject_id: int) -> Path:
         """Get input annotation file path for a subject
@@ -135,16 +220,9 @@ class PipelineConfig:
         Returns:
             Path to input annotation file
         """
-        annotation_dir = self.get('input_halo_annotations', 'Input/Halo_extract/Annotations')
-        
         # Check for special annotation suffix
-        special_key = f'special_annotation_{subject_id}'
-        if special_key in self.config:
-            annotation_suffix = self.get(special_key)
-        else:
-            annotation_suffix = self.get('annotation_suffix', '-A1-AT8.annotations')
-        
-        return Path(annotation_dir) / f"{subject_id}{annotation_suffix}"
+        return self._cached(('annotation', str(subject_id)),
+                            lambda: self._annotation_dir / f"{subject_id}{self.get_annotation_suffix(subject_id)}")
     
     def get_annotation_suffix(self, subject_id: int) -> str:
         """Get annotation suffix for a specific subject
@@ -155,10 +233,13 @@ class PipelineConfig:
         Returns:
             Annotation file suffix
         """
-        special_key = f'special_annotation_{subject_id}'
-        if special_key in self.config:
-            return self.get(special_key)
-        return self.get('annotation_suffix', '-A1-AT8.annotations')
+        def build():
+            special_key = f'special_annotation_{subject_id}'
+            if special_key in self.config:
+                return self.get(special_key)
+            return self.get('annotation_suffix', '-A1-AT8.annotations')
+        
+        return self._cached(('annotation_suffix', str(subject_id)), build)
 
 
 def setup_logging(verbose: bool = False) -> logging.Logger:
@@ -176,44 +257,197 @@ def setup_logging(verbose: bool = False) -> logging.Logger:
     logs_dir = Path('logs')
     logs_dir.mkdir(exist_ok=True)
     
+    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    
+    # Buffer file records and write them in batches; errors are flushed immediately.
+    # The target formats the records, so it needs the formatter itself.
+    file_handler = logging.FileHandler(logs_dir / 'pipeline.log')
+    file_handler.setFormatter(logging.Formatter(log_format))
+    memory_handler = logging.handlers.MemoryHandler(1024, flushLevel=logging.ERROR, target=file_handler)
+    
     # Setup logging
     logging.basicConfig(
         level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        format=log_format,
         handlers=[
-            logging.FileHandler(logs_dir / 'pipeline.log'),
-            logging.StreamHandler(sys.stdout)
+            memory_handler,
+            # stderr, as basicConfig uses, so logs stay apart from printed output
+            logging.StreamHandler()
         ]
     )
     
     return logging.getLogger('QNPtoVox')
 
 
-def validate_inputs(config: PipelineConfig, subjects: List[int], logger: logging.Logger) -> bool:
+def init_worker_logging(log_queue, level: int):
+    """Route a worker process's log records to the parent through a queue
+    
+    Used as a multiprocessing.Pool initializer. Workers started with spawn or
+    forkserver have no handlers of their own, and forked workers would write
+    through copies of the parent's handlers, so the root logger is pointed at
+    a single QueueHandler and the parent's QueueListener does the writing.
+    
+    Args:
+        log_queue: Queue read by the parent's QueueListener
+        level: Root logger level of the parent
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+
+
+def find_missing_files(paths: List[Path]) -> List[Path]:
+    """Find which of the given files do not exist, listing each parent directory once
+    
+    Names missing from the listing are confirmed with exists(), so a file whose
+    case differs on a case-insensitive filesystem (e.g. 001.MGZ on macOS) is
+    still found, as it was before the listing was introduced.
+    
+    Args:
+        paths: Files to check
+    
+    Returns:
+        Paths that are missing, in input order
+    """
+    dir_entries: Dict[Path, set] = {}
+    missing = []
+    for path in paths:
+        parent = path.parent
+        if parent not in dir_entries:
+            try:
+                with os.scandir(parent) as entries:
+                    dir_entries[parent] = {entry.name for entry in entries}
+            except OSError:
+                dir_entries[parent] = set()
+        if path.name not in dir_entries[parent] and not path.exists():
+            missing.append(path)
+    return missing
+
+
+# Coarsest directory mtime resolution to allow for (FAT and HFS+ / some NFS servers round to 1-2 s)
+_MTIME_RESOLUTION_NS = 2_000_000_000
+
+
+def find_missing_files_cached(paths: List[Path], cache_file: Path, use_cache: bool = True) -> List[Path]:
+    """Find which of the given files do not exist, skipping directories validated before
+    
+    The cache records, for each directory, its modification time, the expected
+    files found in it and when it was listed. Adding, removing or renaming an entry
+    changes a directory's mtime, so while it is unchanged a single stat of the
+    directory stands in for listing it again. As with git's racily clean index
+    entries, a listing taken within the filesystem's mtime resolution of the
+    directory's mtime is not trusted, since a change in the same tick would leave
+    the mtime unchanged.
+    
+    Args:
+        paths: Files to check
+        cache_file: JSON file holding the validation cache
+        use_cache: Read the existing cache (the cache is rewritten either way)
+    
+    Returns:
+        Paths that are missing, in input order
+    """
+    cache = {}
+    if use_cache:
+        try:
+            cache = json.loads(Path(cache_file).read_text())
+        except (OSError, ValueError):
+            cache = {}
+    
+    by_parent: Dict[Path, List[Path]] = {}
+    for path in paths:
+        by_parent.setdefault(path.parent, []).append(path)
+    
+    missing = set()
+    for parent, parent_paths in by_parent.items():
+        try:
+            mtime_ns = os.stat(parent).st_mtime_ns
+        except OSError:
+            missing.update(parent_paths)
+            cache.pop(str(parent), None)
+            continue
+        cached = cache.get(str(parent))
+        trusted = (cached is not None and len(cached) == 3 and cached[0] == mtime_ns
+                   and cached[2] - mtime_ns > _MTIME_RESOLUTION_NS)
+        if trusted and {p.name for p in parent_paths} <= set(cached[1]):
+            continue
+        listed_ns = time.time_ns()
+        parent_missing = find_missing_files(parent_paths)
+        missing.update(parent_missing)
+        present = {p.name for p in parent_paths if p not in parent_missing}
+        if trusted:
+            present.update(cached[1])
+            listed_ns = cached[2]
+        cache[str(parent)] = [mtime_ns, sorted(present), listed_ns]
+    
+    try:
+        Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+        Path(cache_file).write_text(json.dumps(cache))
+    except OSError:
+        pass
+    
+    return [path for path in paths if path in missing]
+
+
+def get_validation_cache_file(config: PipelineConfig) -> Path:
+    """Get the input validation cache file in the logs directory"""
+    return Path(config.get('logs_dir', 'logs')) / 'validation_cache.json'
+
+
+def find_complete_subjects(expected_outputs: Dict[int, List[Path]]) -> List[int]:
+    """Find subjects whose expected output files all exist
+    
+    All subjects' files are checked together, so each output directory is
+    listed once however many files are expected in it.
+    
+    Args:
+        expected_outputs: Expected output files for each subject
+    
+    Returns:
+        Subjects with every expected output present, in input order
+    """
+    missing = set(find_missing_files([path for paths in expected_outputs.values() for path in paths]))
+    return [subject for subject, paths in expected_outputs.items()
+            if paths and not any(path in missing for path in paths)]
+
+
+def is_nonempty_dir(path: Path) -> bool:
+    """Check that a directory exists and has at least one entry, with a single scandir
+    
+    Args:
+        path: Directory to check
+    
+    Returns:
+        True if the directory exists and is not empty
+    """
+    try:
+        with os.scandir(path) as entries:
+            return next(entries, None) is not None
+    except OSError:
+        return False
+
+
+def validate_inputs(config: PipelineConfig, subjects: List[int], logger: logging.Logger, force: bool = False) -> bool:
     """Validate input files for all subjects
     
     Args:
         config: Pipeline configuration
         subjects: List of subject IDs
         logger: Logger instance
+        force: Ignore the validation cache and list every input directory
         
     Returns:
         True if all inputs are valid, False otherwise
     """
     logger.info(f"Validating inputs for {len(subjects)} subjects")
     
-    missing_files = []
-    
+    # Check MGZ images and annotation files
+    expected_files = []
     for subject in subjects:
-        # Check MGZ image
-        mgz_path = config.get_input_mgz_path(subject)
-        if not mgz_path.exists():
-            missing_files.append(str(mgz_path))
-        
-        # Check annotation file
-        annotation_path = config.get_input_annotation_path(subject)
-        if not annotation_path.exists():
-            missing_files.append(str(annotation_path))
+        expected_files.append(config.get_input_mgz_path(subject))
+        expected_files.append(config.get_input_annotation_path(subject))
+    missing_files = [str(path) for path in find_missing_files_cached(
+        expected_files, get_validation_cache_file(config), use_cache=not force)]
     
     if missing_files:
         logger.error(f"Missing {len(missing_files)} input files:")
@@ -236,8 +470,7 @@ def create_output_directories(config: PipelineConfig, subjects: List[int], logge
         logger: Logger instance
     """
     # Create main output directory
-    output_base = config.get('output_base', 'output')
-    Path(output_base).mkdir(parents=True, exist_ok=True)
+    config.get_output_base().mkdir(parents=True, exist_ok=True)
     
     # Create logs directory
     logs_dir = config.get('logs_dir', 'logs')
@@ -267,7 +500,7 @@ def check_existing_outputs(config: PipelineConfig, subjects: List[int], step_suf
     
     for subject in subjects:
         step_dir = config.get_subject_step_dir(subject, step_suffix)
-        if step_dir.exists() and any(step_dir.iterdir()):
+        if is_nonempty_dir(step_dir):
             existing.append(subject)
     
     if existing:
@@ -276,15 +509,239 @@ def check_existing_outputs(config: PipelineConfig, subjects: List[int], step_suf
     return existing
 
 
-def run_r_script(script_path: str, args: List[str], logger: logging.Logger, cwd: Optional[Path] = None) -> bool:
-    """Run an R script with arguments
+def prefetch_file(path: Path):
+    """Ask the kernel to start reading a file into the page cache
+    
+    The readahead runs asynchronously, so a later read of the file overlaps
+    with whatever the caller does in the meantime. No-op where posix_fadvise
+    is unavailable (e.g. macOS) or the file cannot be opened.
+    
+    Args:
+        path: File that will be read soon
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def cache_key(inputs: List[Path], config_subset: Dict[str, Any]) -> str:
+    """Compute a cache key for a step from its inputs and relevant configuration
+    
+    Inputs are identified by path, modification time and size rather than by
+    content, so the key is cheap to compute even for large images.
+    
+    Args:
+        inputs: Input files the step reads
+        config_subset: Configuration values that affect the step's outputs
+    
+    Returns:
+        Hex digest identifying this combination of inputs and configuration
+    """
+    hasher = hashlib.sha256()
+    for path in inputs:
+        stat = os.stat(path)
+        hasher.update(f"{Path(path).resolve()}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode())
+    hasher.update(json.dumps(config_subset, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+@functools.lru_cache(maxsize=64)
+def _file_digest(path: str, mtime_ns: int, size: int, chunk_size: int) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Compute a blake2b digest of a file's contents
+    
+    The file is read in chunk_size blocks so large images are never held in
+    memory; digests are memoized on (path, mtime, size) so a file shared by
+    many subjects (e.g. the MNI template) is only read once per run.
+    
+    Args:
+        path: File to hash
+        chunk_size: Read size in bytes
+    
+    Returns:
+        Hex digest of the file contents
+    """
+    stat = os.stat(path)
+    return _file_digest(str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size, chunk_size)
+
+
+def content_cache_key(inputs: List[Path], params: Dict[str, Any]) -> str:
+    """Compute a cache key from the contents of the inputs and a set of parameters
+    
+    Unlike cache_key(), the key survives touching or copying the inputs, which
+    suits steps whose outputs are expensive enough to justify reading every byte.
+    
+    Args:
+        inputs: Input files the step reads
+        params: Parameters that affect the step's outputs
+    
+    Returns:
+        Hex digest identifying this combination of input contents and parameters
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for path in inputs:
+        hasher.update(f"{file_digest(path)}\n".encode())
+    hasher.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+def get_cache_dir(config: PipelineConfig, step_suffix: str) -> Path:
+    """Get the output cache directory for a step
+    
+    Args:
+        config: Pipeline configuration
+        step_suffix: Step directory suffix
+    
+    Returns:
+        Path to the step's cache directory
+    """
+    return config.get_output_base() / '.cache' / step_suffix.lstrip('_')
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """Hardlink src to dst, copying instead when they are on different filesystems"""
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def restore_cached_outputs(config: PipelineConfig, step_suffix: str, key: str,
+                           output_files: List[Path], logger: logging.Logger, force: bool = False) -> bool:
+    """Restore a step's outputs from the cache
+    
+    Whenever nothing is restored, existing output files are removed so that the
+    step writes fresh files instead of writing through hardlinks into cache
+    entries stored by an earlier run.
+    
+    Args:
+        config: Pipeline configuration
+        step_suffix: Step directory suffix
+        key: Cache key from cache_key()
+        output_files: Output files the step produces
+        logger: Logger instance
+        force: Skip the cache lookup so the step is recomputed
+    
+    Returns:
+        True if all outputs were restored, False otherwise
+    """
+    if config.get('cache_enabled', True) and not force:
+        entry = get_cache_dir(config, step_suffix) / key
+        manifest_file = entry / 'manifest.json'
+        try:
+            if manifest_file.exists():
+                cached_names = set(json.loads(manifest_file.read_text())['files'])
+                if all(output_file.name in cached_names for output_file in output_files):
+                    for output_file in output_files:
+                        output_file.parent.mkdir(parents=True, exist_ok=True)
+                        _link_or_copy(entry / output_file.name, output_file)
+                    # Mark the entry as recently used for LRU eviction
+                    os.utime(manifest_file)
+                    return True
+        except Exception as e:
+            logger.warning(f"Failed to restore cache entry {entry}: {e}")
+    
+    for output_file in output_files:
+        if output_file.exists():
+            output_file.unlink()
+    return False
+
+
+def store_cached_outputs(config: PipelineConfig, step_suffix: str, key: str,
+                         output_files: List[Path], logger: logging.Logger):
+    """Store a step's outputs in the cache and evict old entries
+    
+    Args:
+        config: Pipeline configuration
+        step_suffix: Step directory suffix
+        key: Cache key from cache_key()
+        output_files: Output files the step produced
+        logger: Logger instance
+    """
+    if not config.get('cache_enabled', True):
+        return
+    
+    entry = get_cache_dir(config, step_suffix) / key
+    try:
+        entry.mkdir(parents=True, exist_ok=True)
+        for output_file in output_files:
+            _link_or_copy(output_file, entry / output_file.name)
+        # Write the manifest last so partially stored entries are never restored
+        (entry / 'manifest.json').write_text(json.dumps({'files': [f.name for f in output_files]}))
+    except Exception as e:
+        logger.warning(f"Failed to store cache entry {entry}: {e}")
+        return
+    
+    evict_cache(config, logger)
+
+
+def evict_cache(config: PipelineConfig, logger: logging.Logger):
+    """Evict least recently used cache entries beyond cache_max_gb
+    
+    Args:
+        config: Pipeline configuration
+        logger: Logger instance
+    """
+    max_gb = config.get('cache_max_gb', None)
+    if max_gb is None:
+        return
+    
+    cache_root = config.get_output_base() / '.cache'
+    entries = []
+    for manifest_file in cache_root.glob('*/*/manifest.json'):
+        entry = manifest_file.parent
+        size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+        entries.append((manifest_file.stat().st_mtime, size, entry))
+    
+    total_size = sum(size for _, size, _ in entries)
+    limit = float(max_gb) * 1024 ** 3
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total_size <= limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+        logger.debug("Evicted cache entry %s", entry)
+
+
+def _tail_lines(stream, n: int = 100) -> List[str]:
+    """Read the last n lines of a binary file object from its start"""
+    stream.seek(0)
+    return [line.decode(errors='replace').rstrip() for line in deque(stream, maxlen=n)]
+
+
+def _log_command(logger: logging.Logger, message: str, cmd: List[str]):
+    """Log a command line at DEBUG, only building the string when DEBUG is enabled"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", message, shlex.join(cmd))
+
+
+async def run_r_script_async(script_path: str, args: List[str], logger: logging.Logger, cwd: Optional[Path] = None) -> bool:
+    """Run an R script with arguments without blocking the event loop
     
     Args:
         script_path: Path to R script
         args: Arguments to pass to R script
         logger: Logger instance
         cwd: Working directory for R script
-        
+    
     Returns:
         True if successful, False otherwise
     """
@@ -292,28 +749,52 @@ def run_r_script(script_path: str, args: List[str], logger: logging.Logger, cwd:
         cmd = ['Rscript', script_path] + args
         logger.info(f"Running R script: {' '.join(cmd)}")
         
-        result = subprocess.run(
-            cmd,
-            cwd=cwd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        if result.stdout:
-            logger.debug(f"R script stdout: {result.stdout}")
-        if result.stderr:
-            logger.debug(f"R script stderr: {result.stderr}")
+        returncode, stderr = await run_command_async(cmd, logger, cwd=cwd)
+        if returncode != 0:
+            logger.error(f"R script failed with return code {returncode}")
+            logger.error("stderr: " + "\n".join(stderr))
+            return False
         
         return True
-        
-    except subprocess.CalledProcessError as e:
-        logger.error(f"R script failed with return code {e.returncode}")
-        if e.stdout:
-            logger.error(f"stdout: {e.stdout}")
-        if e.stderr:
-            logger.error(f"stderr: {e.stderr}")
-        return False
+    
     except Exception as e:
         logger.error(f"Failed to run R script: {e}")
-        return False 
\ No newline at end of file
+        return False
+
+
+async def run_command_async(cmd: List[str], logger: logging.Logger, cwd: Optional[Path] = None,
+                            env: Optional[Dict[str, str]] = None, stderr_path: Optional[Path] = None,
+                            tail_lines: int = 100) -> Tuple[int, List[str]]:
+    """Run a command without blocking the event loop or buffering its output
+    
+    stderr is written to stderr_path (or an anonymous temporary file) and stdout
+    is discarded, or streamed to the log line by line when DEBUG is enabled, so
+    memory use is constant however much the command prints.
+    
+    Args:
+        cmd: Command and arguments
+        logger: Logger instance
+        cwd: Working directory for the command
+        env: Environment for the command
+        stderr_path: File to keep the command's stderr in
+        tail_lines: Number of trailing stderr lines to return on failure
+    
+    Returns:
+        Tuple of (return code, last stderr lines if the command failed)
+    """
+    _log_command(logger, "Command", cmd)
+    stream_stdout = logger.isEnabledFor(logging.DEBUG)
+    with (open(stderr_path, 'w+b') if stderr_path else tempfile.TemporaryFile()) as err:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            env=env,
+            stdout=asyncio.subprocess.PIPE if stream_stdout else asyncio.subprocess.DEVNULL,
+            stderr=err,
+            limit=1 << 20
+        )
+        if stream_stdout:
+            async for line in proc.stdout:
+                logger.debug("%s: %s", cmd[0], line.decode(errors='replace').rstrip())
+        returncode = await proc.wait()
+        return returncode, (_tail_lines(err, tail_lines) if returncode != 0 else [])
\ No newline at end of file
@@ -32,11 +32,15 @@ import os
 import sys
 import argparse
 import logging
+from collections import defaultdict
 from pathlib import Path
 from typing import List, Optional
 
 # Import pipeline components
-from pipeline_utils import PipelineConfig, create_output_directories, check_existing_outputs
+from pipeline_utils import (
+    PipelineConfig, create_output_directories, check_existing_outputs,
+    is_nonempty_dir, setup_logging, validate_inputs
+)
 from pipeline_steps import (
     UpsamplingStep, SlicingStep, CoordinateExtractionStep, 
     CoordinateTransformationStep, KernelApplicationStep, MNIRegistrationStep
@@ -58,12 +62,8 @@ class QNPPipeline:
         self.logger = self._setup_logging(verbose)
         
     def _setup_logging(self, verbose: bool = False) -> logging.Logger:
-        """Setup logging"""
-        level = logging.DEBUG if verbose else logging.INFO
-        logging.basicConfig(
-            level=level,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        """Setup logging to the console and the buffered logs/pipeline.log"""
+        setup_logging(verbose)
         return logging.getLogger(__name__)
     
     def show_info(self):
@@ -88,42 +88,39 @@ class QNPPipeline:
             ('6. MNI Registration (Separate)', '_mni_registration'),
         ]
         
+        completed_dirs = self._scan_completed_step_dirs(subjects)
         for step_name, suffix in steps:
-            completed = 0
-            for subject in subjects:
-                step_dir = self.config.get_subject_step_dir(subject, suffix)
-                if step_dir.exists() and any(step_dir.iterdir()):
-                    completed += 1
+            completed = sum(f"{subject}{suffix}" in completed_dirs[str(subject)] for subject in subjects)
             print(f"  {step_name}: {completed}/{len(subjects)} subjects")
     
-    def validate_inputs(self, subjects: Optional[List[int]] = None) -> bool:
-        """Validate input files for specified subjects"""
-        subjects = subjects or self.config.get_subjects()
-        self.logger.info(f"Validating inputs for {len(subjects)} subjects")
-        
-        missing_files = []
-        
-        for subject in subjects:
-            # Check MGZ files
-            mgz_path = self.config.get_input_mgz_path(subject)
-            if not mgz_path.exists():
-                missing_files.append(str(mgz_path))
-            
-            # Check annotation files
-            annotation_path = self.config.get_input_annotation_path(subject)
-            if not annotation_path.exists():
-                missing_files.append(str(annotation_path))
+    def _scan_completed_step_dirs(self, subjects: List[int]) -> defaultdict:
+        """Walk the output base once, collecting each subject's non-empty step directories
         
-        if missing_files:
-            self.logger.error(f"Missing {len(missing_files)} input files:")
-            for file in missing_files[:10]:
-                self.logger.error(f"  - {file}")
-            if len(missing_files) > 10:
-                self.logger.error(f"  ... and {len(missing_files) - 10} more")
-            return False
+        Args:
+            subjects: List of subject IDs
         
-        self.logger.info("All input files validated successfully")
-        return True
+        Returns:
+            Mapping of subject ID (as a string) to the names of its non-empty step directories
+        """
+        completed_dirs = defaultdict(set)
+        wanted = {str(subject) for subject in subjects}
+        try:
+            with os.scandir(self.config.get_output_base()) as subject_entries:
+                for subject_entry in subject_entries:
+                    if subject_entry.name not in wanted or not subject_entry.is_dir():
+                        continue
+                    with os.scandir(subject_entry.path) as step_entries:
+                        for step_entry in step_entries:
+                            if step_entry.is_dir() and is_nonempty_dir(step_entry.path):
+                                completed_dirs[subject_entry.name].add(step_entry.name)
+        except OSError:
+            pass
+        return completed_dirs
+    
+    def validate_inputs(self, subjects: Optional[List[int]] = None, force: bool = False) -> bool:
+        """Validate input files for specified subjects (force ignores the validation cache)"""
+        subjects = subjects or self.config.get_subjects()
+        return validate_inputs(self.config, subjects, self.logger, force)
     
     def run_pipeline(self, subjects: Optional[List[int]] = None, steps: Optional[List[str]] = None,
                     force: bool = False, dry_run: bool = False) -> bool:
@@ -253,7 +250,7 @@ def main():
     
     # Handle validate-only mode
     if args.validate_only:
-        valid = pipeline.validate_inputs(args.subjects)
+        valid = pipeline.validate_inputs(args.subjects, force=args.force)
         if valid:
             print("All input files validated successfully")
             sys.exit(0)
@@ -277,6 +274,9 @@ def main():
     except Exception as e:
         print(f"Pipeline failed: {e}")
         sys.exit(1)
+    finally:
+        # Flush buffered log records before exiting
+        logging.shutdown()
 
 
 if __name__ == "__main__":